@@ -5,21 +5,35 @@ import sys
 import json
 import time
 import uuid
+import hashlib
+import hmac
 import re
 from pathlib import Path
 from datetime import datetime
+from collections import OrderedDict, deque
+from functools import wraps
 from typing import Dict, Any, List, Optional
-import math
 import asyncio
-import tempfile
+import threading
+import queue
+import atexit
 
 import requests
+from requests.adapters import HTTPAdapter
 import psutil
+import numpy as np
 from flask import (
-    Flask, request, jsonify, session, g, redirect, make_response, render_template
+    Flask, Response, request, jsonify, session, g, redirect, render_template
 )
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 try:
     import edge_tts
     EDGE_TTS_AVAILABLE = True
@@ -31,6 +45,7 @@ try:
     import pynvml
     pynvml.nvmlInit()
     NVML_AVAILABLE = True
+    atexit.register(pynvml.nvmlShutdown)
 except Exception:
     NVML_AVAILABLE = False
 
@@ -52,124 +67,376 @@ NUM_CTX = int(os.getenv("NUM_CTX", "4096"))
 GEN_TEMP = float(os.getenv("GEN_TEMP", "0.7"))
 TOP_P = float(os.getenv("TOP_P", "0.9"))
 
+_OLLAMA_SESSION = requests.Session()
+_OLLAMA_SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+_OLLAMA_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
 ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 SECRET_KEY = os.getenv("SECRET_KEY", "a-seed-secret-key-dev")
+_ADMIN_USER_B = ADMIN_USER.encode("utf-8")
+_ADMIN_PASSWORD_B = ADMIN_PASSWORD.encode("utf-8")
 
 app = Flask(__name__, static_folder=str(STATIC_DIR), template_folder='templates')
 app.secret_key = SECRET_KEY
 app.config.update(SESSION_COOKIE_SAMESITE='Lax', SESSION_COOKIE_SECURE=False)
 
-START_TS = time.time()
+if ORJSON_AVAILABLE:
+    def dumps_json(o, indent=False): return orjson.dumps(o, option=orjson.OPT_INDENT_2 if indent else 0)
+    loads_json = orjson.loads
+
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kw): return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+        def loads(self, s, **kw): return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+else:
+    def dumps_json(o, indent=False): return json.dumps(o, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+    def loads_json(b): return json.loads(b)
+
+_START_NS = time.time_ns()
+_PID = os.getpid()
+_PY_VER = sys.version.split(" ")[0]
+_SELF_PROC = psutil.Process(_PID)
+# frozen at import so a restart re-execs the same script even if the cwd has changed since
+_EXEC_PY = os.path.abspath(sys.executable)
+_EXEC_ARGS = [os.path.abspath(a) if i == 0 and os.path.exists(a) else a for i, a in enumerate(sys.argv)]
 
 def now_ts(): return int(time.time())
-def read_users(): return json.load(USERS_FILE.open("r", encoding="utf-8")) if USERS_FILE.exists() else {}
-def write_users(u): json.dump(u, USERS_FILE.open("w", encoding="utf-8"), indent=2)
-def safe_json(s): 
-    try: return json.loads(re.search(r"\{.*\}", s, re.DOTALL).group(0))
-    except: return {}
+_users_cache = {"mtime": -1, "data": {}}
+def read_users():
+    try: m = USERS_FILE.stat().st_mtime_ns
+    except FileNotFoundError: return {}
+    if m != _users_cache["mtime"]:
+        _users_cache["data"] = loads_json(USERS_FILE.read_bytes())
+        _users_cache["mtime"] = m
+    # a copy, since callers add entries before write_users; the cache only ever holds what is on disk
+    return dict(_users_cache["data"])
+def write_users(u):
+    USERS_FILE.write_bytes(dumps_json(u, indent=True))
+    _users_cache["data"], _users_cache["mtime"] = dict(u), USERS_FILE.stat().st_mtime_ns
+_ID_RE = re.compile(r'[^\w-]')
+_JSON_TOK_RE = re.compile(r'[{}"\\]')
+SAFE_JSON_RESCANS = 4
+def safe_json(s):
+    # one pass over the structural chars: a stack of open-brace offsets yields the outermost balanced
+    # {...} spans, tried in order; a rescan only happens for a "{" the quote parity hid inside a string
+    start = s.find("{")
+    for _ in range(SAFE_JSON_RESCANS):
+        if start == -1: break
+        stack, spans, in_str, skip, hidden = [], [], False, -1, -1
+        for m in _JSON_TOK_RE.finditer(s, start):
+            i, c = m.start(), m.group()
+            if i < skip: continue
+            if in_str:
+                if c == "\\": skip = i + 2
+                elif c == '"': in_str = False
+                elif c == "{" and hidden == -1: hidden = i
+            elif c == '"': in_str = True
+            elif c == "{": stack.append(i)
+            elif c == "}" and stack:
+                j = stack.pop()
+                while spans and spans[-1][0] > j: spans.pop()
+                if not stack:
+                    try: return loads_json(s[j:i + 1])
+                    except: continue
+                spans.append((j, i))
+        for j, i in spans:
+            try: return loads_json(s[j:i + 1])
+            except: pass
+        start = hidden
+    return {}
 def ensure_sid(sid): return sid or str(uuid.uuid4())
 
 def get_user_session_dir():
     uid = session.get('user_id')
     if not uid: return None
-    d = SESS_DIR / re.sub(r'[^\w-]', '', uid)
+    d = SESS_DIR / _ID_RE.sub('', uid)
     d.mkdir(exist_ok=True)
     return d
 
 def session_path(sid):
     d = get_user_session_dir()
-    return (d / f"{re.sub(r'[^\w-]', '', sid)}.json") if d else None
+    return (d / f"{_ID_RE.sub('', sid).lstrip('_')}.json") if d else None
 
 def write_json(p, o):
     if p:
-        json.dump(o, p.with_suffix(".tmp").open("w", encoding="utf-8"), ensure_ascii=False, indent=2)
+        p.with_suffix(".tmp").write_bytes(dumps_json(o, indent=True))
         p.with_suffix(".tmp").replace(p)
 
-def read_json(p): return json.load(p.open("r", encoding="utf-8")) if p and p.exists() else None
+def read_json(p): return loads_json(p.read_bytes()) if p and p.exists() else None
+
+SESSION_INDEX = "_index.json"
+
+def session_meta(o): return {"sid": o.get("sid"), "title": o.get("title"), "count": len(o.get("chat") or []), "updated": o.get("updated", 0)}
+
+def session_files(d):
+    # is_file() comes free from the directory read; stat() is only paid for the .json entries that pass the filter
+    with os.scandir(d) as it:
+        return [(Path(e.path), e.stat().st_mtime) for e in it
+                if e.name.endswith(".json") and not e.name.startswith("_") and e.is_file()]
+
+def rebuild_session_index(d):
+    idx = {}
+    for p, _ in session_files(d):
+        try: o = read_json(p)
+        except: continue
+        if o and o.get("sid"): idx[o["sid"]] = session_meta(o)
+    write_json(d / SESSION_INDEX, idx)
+    return idx
+
+def read_session_index(d):
+    try: idx = read_json(d / SESSION_INDEX)
+    except: idx = None
+    return idx if isinstance(idx, dict) else rebuild_session_index(d)
+
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+
+def user_lock(user_id):
+    with _user_locks_guard: return _user_locks.setdefault(user_id, threading.Lock())
+
+_persist_q = queue.Queue()
+
+def _persist_worker():
+    while True:
+        job = _persist_q.get()
+        try:
+            if job is None: return
+            fn, args = job
+            fn(*args)
+        except Exception as e: print(f"persist error: {e}", flush=True)
+        finally: _persist_q.task_done()
+
+def enqueue_persist(fn, *args): _persist_q.put((fn, args))
+
+_persist_thread = threading.Thread(target=_persist_worker, daemon=True)
+_persist_thread.start()
+
+@atexit.register
+def drain_persist(timeout=10):
+    _persist_q.put(None)
+    _persist_thread.join(timeout)
 
 def get_mem_path(user_id):
-    safe_uid = re.sub(r'[^\w-]', '', user_id)
-    return MEM_DIR / f"{safe_uid}.json"
+    safe_uid = _ID_RE.sub('', user_id)
+    return MEM_DIR / safe_uid
+
+def mem_files(base, dim):
+    # one vector/text pair per embedding size, so changing EMBED_MODEL starts a new pair instead of corrupting the old one
+    return base / f"{dim}.i8", base / f"{dim}.jsonl"
+
+def has_memory(base): return base.is_dir() or base.with_suffix(".json").exists()
 
-def get_embedding(text):
+def read_lines(p):
     try:
-        url = f"{OLLAMA_HOST}/api/embeddings"
-        payload = {"model": EMBED_MODEL, "prompt": text}
-        r = requests.post(url, json=payload, timeout=5)
-        if r.status_code == 200:
-            return r.json().get("embedding")
-    except: pass
-    return None
-
-def cosine_sim(v1, v2):
-    if not v1 or not v2 or len(v1) != len(v2): return 0.0
-    dot = sum(a * b for a, b in zip(v1, v2))
-    mag1 = math.sqrt(sum(a * a for a in v1))
-    mag2 = math.sqrt(sum(b * b for b in v2))
-    if mag1 == 0 or mag2 == 0: return 0.0
-    return dot / (mag1 * mag2)
-
-def save_memory_npy(user_id, text, role):
-    if not text.strip(): return
-    vec = get_embedding(text)
-    if not vec: return
-    path = get_mem_path(user_id)
-    data = []
-    if path.exists():
-        try: data = json.load(path.open("r", encoding="utf-8"))
-        except: pass
-    data.append({"ts": now_ts(), "role": role, "text": text, "vector": vec})
-    try: json.dump(data, path.open("w", encoding="utf-8"), ensure_ascii=False)
-    except: pass
+        with p.open("rb") as f: return [l if l.endswith(b"\n") else l + b"\n" for l in f if l.strip()]
+    except FileNotFoundError: return []
+
+def migrate_memory(base, dim):
+    # splits a legacy <uid>.json store into base/<dim>.* pairs; the original is kept as .json.bak
+    legacy = base.with_suffix(".json")
+    if mem_files(base, dim)[0].exists() or not legacy.exists(): return
+    try: data = loads_json(legacy.read_bytes())
+    except: return
+    by_dim = {}
+    for i in data or []:
+        if i.get("vector"): by_dim.setdefault(len(i["vector"]), []).append(i)
+    base.mkdir(exist_ok=True)
+    for d, items in by_dim.items():
+        v, l = mem_files(base, d)
+        l.write_bytes(b"".join(dumps_json({"ts": i.get("ts"), "role": i.get("role"), "text": i["text"]}) + b"\n" for i in items))
+        v.write_bytes(b"".join(quantize(i["vector"]).tobytes() for i in items))
+    legacy.replace(legacy.with_suffix(".json.bak"))
+
+EMBED_CACHE_SIZE = 2048
+_embed_cache = OrderedDict()
+_embed_lock = threading.Lock()
+
+def _fetch_embeddings(texts):
+    try:
+        r = _OLLAMA_SESSION.post(f"{OLLAMA_HOST}/api/embed", json={"model": EMBED_MODEL, "input": texts}, timeout=10)
+        if r.status_code != 404: return (r.json().get("embeddings") or []) if r.status_code == 200 else []
+    except: return []
+    out = []  # older Ollama builds only expose the single-prompt endpoint
+    for t in texts:
+        try:
+            r = _OLLAMA_SESSION.post(f"{OLLAMA_HOST}/api/embeddings", json={"model": EMBED_MODEL, "prompt": t}, timeout=5)
+            out.append(r.json().get("embedding") if r.status_code == 200 else None)
+        except: out.append(None)
+    return out
+
+def get_embeddings_batch(texts):
+    with _embed_lock: miss = [t for t in dict.fromkeys(texts) if t not in _embed_cache]
+    got = _fetch_embeddings(miss) if miss else []
+    out = []
+    with _embed_lock:
+        for t, v in zip(miss, got):
+            # float32 array: ~3 KB per 768-d entry versus ~24 KB for a tuple of Python floats
+            if v: _embed_cache[t] = np.asarray(v, dtype=np.float32)
+        for t in texts:
+            v = _embed_cache.get(t)
+            if v is not None: _embed_cache.move_to_end(t)
+            out.append(v)
+        while len(_embed_cache) > EMBED_CACHE_SIZE: _embed_cache.popitem(last=False)
+    return out
+
+def get_embedding(text): return get_embeddings_batch([text])[0]
+
+def unit_vec(v):
+    a = np.asarray(v, dtype=np.float32)
+    n = float(np.linalg.norm(a))
+    return a / n if n else a
+
+def quantize(v): return np.round(unit_vec(v) * 127).astype(np.int8)
+
+def save_memory_npy(user_id, entries):
+    entries = [(t, r) for t, r in entries if t.strip()]
+    if not entries: return
+    vecs = get_embeddings_batch([t for t, _ in entries])
+    rows = [(t, r, v) for (t, r), v in zip(entries, vecs) if v is not None]
+    if not rows: return
+    dim = len(rows[-1][2])
+    rows = [x for x in rows if len(x[2]) == dim]
+    base = get_mem_path(user_id)
+    vec_p, log_p = mem_files(base, dim)
+    with user_lock(user_id):
+        migrate_memory(base, dim)
+        base.mkdir(exist_ok=True)
+        sizes = [p.stat().st_size if p.exists() else 0 for p in (vec_p, log_p)]
+        try:
+            with vec_p.open("ab") as f: f.write(b"".join(quantize(v).tobytes() for _, _, v in rows))
+            with log_p.open("ab") as f: f.write(b"".join(dumps_json({"ts": now_ts(), "role": r, "text": t}) + b"\n" for t, r, _ in rows))
+        except Exception as e:
+            # roll both files back so row i keeps matching line i
+            for p, n in zip((vec_p, log_p), sizes):
+                try: os.truncate(p, n)
+                except OSError: pass
+            print(f"memory save error: {e}", flush=True)
+
+MEM_CACHE_USERS = 64
+_mem_cache = OrderedDict()
+_mem_cache_lock = threading.Lock()
+
+def load_memory_matrix(user_id, dim):
+    base = get_mem_path(user_id)
+    vec_p, log_p = mem_files(base, dim)
+    with user_lock(user_id):
+        migrate_memory(base, dim)
+        try: st = vec_p.stat()
+        except FileNotFoundError: return None, []
+        key = (st.st_mtime_ns, st.st_size, dim)
+        with _mem_cache_lock:
+            hit = _mem_cache.pop(user_id, None)
+            if hit and hit[0] == key:
+                _mem_cache[user_id] = hit
+                return hit[1], hit[2]
+        lines = read_lines(log_p)
+        n = min(st.st_size // dim, len(lines))
+        if n * dim != st.st_size or n != len(lines):
+            # a crash between the two appends; trim both back to the rows that still pair up
+            print(f"memory: {vec_p} has {st.st_size // dim} rows for {len(lines)} lines, trimming both to {n}", flush=True)
+            try:
+                os.truncate(vec_p, n * dim)
+                log_p.write_bytes(b"".join(lines[:n]))
+                st = vec_p.stat()
+                key = (st.st_mtime_ns, st.st_size, dim)
+            except OSError as e: print(f"memory repair error: {e}", flush=True)
+        if not n: return None, []
+        texts = []
+        for l in lines[:n]:
+            try: texts.append(loads_json(l)["text"])
+            except: texts.append("")
+        # read into memory rather than mapping: no descriptor stays open, and the file can be truncated later;
+        # int8 on disk, widened to float32 once here so every query is a single BLAS matvec
+        M = np.fromfile(vec_p, dtype=np.int8, count=n * dim).reshape(n, dim).astype(np.float32)
+        with _mem_cache_lock:
+            _mem_cache[user_id] = (key, M, texts)
+            while len(_mem_cache) > MEM_CACHE_USERS: _mem_cache.popitem(last=False)
+    return M, texts
+
+RAG_CACHE_SIZE = 64
+RAG_CACHE_SIM = 0.95
+_rag_cache = {}
 
 def find_relevant_npy(user_id, query, top_k=3):
-    path = get_mem_path(user_id)
-    if not path.exists(): return ""
+    if not has_memory(get_mem_path(user_id)): return ""
     q_vec = get_embedding(query)
-    if not q_vec: return ""
-    try: data = json.load(path.open("r", encoding="utf-8"))
-    except: return ""
-    if not data: return ""
-    scores = []
-    for item in data:
-        scores.append((cosine_sim(q_vec, item["vector"]), item["text"]))
-    scores.sort(key=lambda x: x[0], reverse=True)
-    res = [s[1] for s in scores[:top_k]]
-    return ("\n\n[Relevant Context]:\n" + "\n".join([f"- {t}" for t in res])) if res else ""
+    if q_vec is None: return ""
+    qu = unit_vec(q_vec)
+    M, texts = load_memory_matrix(user_id, qu.size)
+    if M is None: return ""
+    # a near-duplicate recent query reuses its top-k and only scores rows appended since
+    hits = _rag_cache.setdefault(user_id, deque(maxlen=RAG_CACHE_SIZE))
+    snap = [h for h in list(hits) if h[0].size == qu.size and h[1] <= len(M)]
+    start, idx, scores = 0, np.empty(0, np.int64), np.empty(0, np.float32)
+    if snap:
+        sims = np.stack([h[0] for h in snap]) @ qu
+        j = int(sims.argmax())
+        if sims[j] > RAG_CACHE_SIM: _, start, idx, scores = snap[j]
+    new = M[start:] @ qu
+    idx = np.concatenate([idx, np.arange(start, len(M))])
+    scores = np.concatenate([scores, new])
+    k = min(top_k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    hits.append((qu, len(M), idx[top], scores[top]))
+    return ("\n\n[Relevant Context]:\n" + "\n".join(f"- {texts[i]}" for i in idx[top]))
+
+TREND_FILE = "_trend.json"
+TREND_KEEP_DAYS = 30
+
+def trend_path(user_id): return SESS_DIR / _ID_RE.sub('', user_id) / TREND_FILE
+
+def rebuild_trends(p):
+    buckets = {}
+    if not p.parent.exists(): return buckets
+    cutoff = now_ts() - TREND_KEEP_DAYS * 86400
+    for f, mtime in session_files(p.parent):
+        if mtime < cutoff: continue
+        try: o = read_json(f)
+        except: continue
+        b = buckets.setdefault(str(o.get("updated", 0) // 86400), {})
+        for m in o.get("chat") or []:
+            if m.get("role") == "assistant":
+                e = m.get("emotion", "neutral")
+                if e != "neutral": b[e] = b.get(e, 0) + 1
+    buckets = {k: v for k, v in buckets.items() if v}
+    write_json(p, {"buckets": buckets})
+    return buckets
+
+def load_trends(user_id):
+    p = trend_path(user_id)
+    try: o = read_json(p)
+    except: o = None
+    if isinstance(o, dict) and isinstance(o.get("buckets"), dict): return o["buckets"]
+    return rebuild_trends(p)
+
+def record_emotion(user_id, emotion):
+    if not emotion or emotion == "neutral": return
+    with user_lock(user_id):
+        p = trend_path(user_id)
+        p.parent.mkdir(exist_ok=True)
+        buckets = load_trends(user_id)
+        today = now_ts() // 86400
+        b = buckets.setdefault(str(today), {})
+        b[emotion] = b.get(emotion, 0) + 1
+        write_json(p, {"buckets": {k: v for k, v in buckets.items() if int(k) > today - TREND_KEEP_DAYS}})
 
 def analyze_user_trends(user_id, days=5):
-    uid = re.sub(r'[^\w-]', '', user_id)
-    d = SESS_DIR / uid
-    if not d.exists(): return ""
-    
-    cutoff = now_ts() - (days * 86400)
-    files = []
-    
-    for p in d.glob("*.json"):
-        try:
-            o = json.load(p.open("r", encoding="utf-8"))
-            if o.get("updated", 0) > cutoff:
-                files.append(o)
-        except: pass
-    
-    if not files: return ""
-    
+    with user_lock(user_id): buckets = load_trends(user_id)
+    today = now_ts() // 86400
     cnt = {}
-    for f in files:
-        for m in f.get("chat", []):
-            if m.get("role") == "assistant":
-                e = m.get("emotion", "neutral")
-                if e != "neutral":
-                    cnt[e] = cnt.get(e, 0) + 1
+    for day in range(today - days + 1, today + 1):
+        for e, n in buckets.get(str(day), {}).items(): cnt[e] = cnt.get(e, 0) + n
     
-    if not cnt: return ""
+    tot = sum(cnt.values())
+    if tot < 3: return ""
     
     dom = max(cnt, key=cnt.get)
     c = cnt[dom]
-    tot = sum(cnt.values())
     
-    if tot >= 3 and (c / tot) > 0.4:
+    if (c / tot) > 0.4:
         msg = f"\n[PSYCHOLOGICAL TREND ANALYSIS]:\n- Last {days} days mood: '{dom.upper()}' ({c}/{tot}).\n"
         bad = ["sadness", "anger", "fear", "anxiety"]
         if dom in bad:
@@ -179,16 +446,78 @@ def analyze_user_trends(user_id, days=5):
 
 def ollama_chat(messages):
     try:
-        r = requests.post(f"{OLLAMA_HOST}/api/chat", json={
+        r = _OLLAMA_SESSION.post(f"{OLLAMA_HOST}/api/chat", json={
             "model": MODEL_NAME, "messages": messages, "stream": False,
             "options": {"num_ctx": NUM_CTX, "temperature": GEN_TEMP, "top_p": TOP_P}
         }, timeout=120)
         return {"text": r.json().get("message", {}).get("content", "")}
     except Exception as e: return {"text": "", "error": str(e)}
 
+def ollama_chat_stream(messages):
+    with _OLLAMA_SESSION.post(f"{OLLAMA_HOST}/api/chat", json={
+        "model": MODEL_NAME, "messages": messages, "stream": True,
+        "options": {"num_ctx": NUM_CTX, "temperature": GEN_TEMP, "top_p": TOP_P}
+    }, stream=True, timeout=120) as r:
+        for line in r.iter_lines(decode_unicode=True):
+            if not line: continue
+            o = loads_json(line)
+            piece = o.get("message", {}).get("content", "")
+            if piece: yield piece
+            if o.get("done"): break
+
+_REPLY_START_RE = re.compile(r'"reply"\s*:\s*"')
+_STR_STOP_RE = re.compile(r'["\\]')
+
+def reply_deltas(pieces):
+    # the model answers with {"emotion": ..., "reply": ...}; pass on only newly decoded text of the reply string
+    buf, pos, closed = "", -1, False
+    for piece in pieces:
+        buf += piece
+        delta = ""
+        if pos < 0:
+            m = _REPLY_START_RE.search(buf, max(0, len(buf) - len(piece) - 16))
+            if m: pos = m.end()
+        if pos >= 0 and not closed:
+            i = pos
+            while True:
+                m = _STR_STOP_RE.search(buf, i)
+                if not m: i = len(buf); break
+                j = m.start()
+                if m.group() == '"': i, closed = j, True; break
+                # hold back an escape until it is complete; a high surrogate waits for its pair
+                n = 2 if buf[j + 1:j + 2] != "u" else 12 if buf[j + 2:j + 4].lower() in ("d8", "d9", "da", "db") else 6
+                if j + n > len(buf): i = j; break
+                i = j + n
+            if i > pos: delta, pos = loads_json(f'"{buf[pos:i]}"'), i
+        yield piece, delta
+
+SYSTEM_PROMPT_FILE = TRAIN_DIR / "a_seed_prompt.txt"
+_sys_prompt = {"mtime": None, "text": "You are A SEED."}
+
 def get_system_prompt():
-    p = TRAIN_DIR / "a_seed_prompt.txt"
-    return p.read_text(encoding="utf-8") if p.exists() else "You are A SEED."
+    try: m = SYSTEM_PROMPT_FILE.stat().st_mtime_ns
+    except FileNotFoundError: return "You are A SEED."
+    if m != _sys_prompt["mtime"]:
+        _sys_prompt["text"] = SYSTEM_PROMPT_FILE.read_text(encoding="utf-8")
+        _sys_prompt["mtime"] = m
+    return _sys_prompt["text"]
+
+LOGIN_CACHE_TTL = 60
+_login_key = os.urandom(32)
+_login_cache = {}
+
+def verify_password(username, user, password):
+    # skip PBKDF2 for an identical credential already verified within the TTL; failures are never cached
+    k = (username, hashlib.blake2b(password.encode("utf-8"), key=_login_key).digest())
+    now = time.monotonic()
+    hit = _login_cache.get(k)
+    if hit and hit[0] > now and hit[1] == user['hash']: return True
+    if not check_password_hash(user['hash'], password): return False
+    if len(_login_cache) > 1024:
+        for key, v in list(_login_cache.items()):
+            if v[0] <= now: _login_cache.pop(key, None)
+    _login_cache[k] = (now + LOGIN_CACHE_TTL, user['hash'])
+    return True
 
 @app.route("/")
 def root(): return redirect('/chat') if 'user_id' in session else redirect('/login')
@@ -218,7 +547,7 @@ def api_login():
     d = request.get_json()
     users = read_users()
     u = users.get(d.get('username'))
-    if u and check_password_hash(u['hash'], d.get('password')):
+    if u and verify_password(d.get('username'), u, d.get('password') or ""):
         session['user_id'] = d.get('username')
         return jsonify({"ok": True})
     return jsonify({"ok": False}), 401
@@ -228,18 +557,14 @@ def api_logout():
     session.clear()
     return jsonify({"ok": True})
 
+# static/app.js checks this once per page load; only two bodies are possible, so they are built once here
+_STATUS_TRUE = b'{"logged_in":true}'
+_STATUS_FALSE = b'{"logged_in":false}'
+
 @app.get("/api/session-check")
-def api_session_check(): return jsonify({"logged_in": 'user_id' in session})
+def api_session_check(): return Response(_STATUS_TRUE if 'user_id' in session else _STATUS_FALSE, mimetype="application/json")
 
-@app.post("/api/chat")
-def api_chat():
-    if 'user_id' not in session: return jsonify({"error": "unauthorized"}), 401
-    d = request.get_json()
-    msg, hist = d.get("message", "").strip(), d.get("history", [])
-    if not msg: return jsonify({"error": "empty"}), 400
-    
-    uid = session['user_id']
-    
+def build_messages(uid, msg, hist):
     trend_ctx = analyze_user_trends(uid)
     
     ctx = find_relevant_npy(uid, msg)
@@ -251,26 +576,65 @@ def api_chat():
     msgs = [{"role": "system", "content": sys_p}]
     for h in hist: msgs.append({"role": h['role'], "content": h['text']})
     msgs.append({"role": "user", "content": msg})
+    return msgs
 
-    out = ollama_chat(msgs)
-    txt = out.get("text", "")
-    if not txt: return jsonify({"error": "backend-failed"}), 500
-
-    save_memory_npy(uid, msg, "user")
-    save_memory_npy(uid, txt, "assistant")
-
+def finish_turn(uid, msg, txt):
+    enqueue_persist(save_memory_npy, uid, [(msg, "user"), (txt, "assistant")])
     obj = safe_json(txt)
-    return jsonify({
+    out = {
         "emotion": (obj.get("emotion") or "neutral").lower().strip(),
         "reply": (obj.get("reply") or txt).strip()
-    })
+    }
+    enqueue_persist(record_emotion, uid, out["emotion"])
+    return out
+
+def sse(data, event=None):
+    return (f"event: {event}\n" if event else "") + f"data: {dumps_json(data).decode()}\n\n"
+
+@app.post("/api/chat")
+def api_chat():
+    if 'user_id' not in session: return jsonify({"error": "unauthorized"}), 401
+    d = request.get_json()
+    msg, hist = d.get("message", "").strip(), d.get("history", [])
+    if not msg: return jsonify({"error": "empty"}), 400
+    
+    uid = session['user_id']
+    msgs = build_messages(uid, msg, hist)
+
+    if d.get("stream"):
+        def gen():
+            parts = []
+            try:
+                for piece, delta in reply_deltas(ollama_chat_stream(msgs)):
+                    parts.append(piece)
+                    if delta: yield sse({"delta": delta})
+            except Exception as e:
+                yield sse({"error": str(e)}, "error")
+                return
+            txt = "".join(parts)
+            if not txt:
+                yield sse({"error": "backend-failed"}, "error")
+                return
+            yield sse(finish_turn(uid, msg, txt), "done")
+        return Response(gen(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    out = ollama_chat(msgs)
+    txt = out.get("text", "")
+    if not txt: return jsonify({"error": "backend-failed"}), 500
+    return jsonify(finish_turn(uid, msg, txt))
 
 @app.post("/api/save")
 def api_save():
     if 'user_id' not in session: return jsonify({"error": "401"}), 401
     d = request.get_json()
     sid = ensure_sid(d.get("sid"))
-    write_json(session_path(sid), {"sid": sid, "title": (d.get("chat", [])[0]['text'] if d.get("chat") else "New Chat")[:60], "chat": d.get("chat"), "updated": now_ts()})
+    p = session_path(sid)
+    o = {"sid": sid, "title": (d.get("chat", [])[0]['text'] if d.get("chat") else "New Chat")[:60], "chat": d.get("chat"), "updated": now_ts()}
+    write_json(p, o)
+    with user_lock(session['user_id']):
+        idx = read_session_index(p.parent)
+        idx[sid] = session_meta(o)
+        write_json(p.parent / SESSION_INDEX, idx)
     return jsonify({"ok": True, "sid": sid})
 
 @app.get("/api/sessions")
@@ -279,9 +643,7 @@ def api_sessions():
     d = get_user_session_dir()
     res = []
     if d:
-        for p in d.glob("*.json"):
-            try: res.append(read_json(p))
-            except: pass
+        with user_lock(session['user_id']): res = list(read_session_index(d).values())
     res.sort(key=lambda x: x.get("updated", 0), reverse=True)
     return jsonify(res)
 
@@ -290,6 +652,22 @@ def api_load():
     if 'user_id' not in session: return jsonify({"error": "401"}), 401
     return jsonify(read_json(session_path(request.args.get("sid"))) or {})
 
+def stream_tts(text, voice):
+    # drive edge-tts' async stream from this sync worker thread, one chunk at a time
+    loop = asyncio.new_event_loop()
+    chunks = edge_tts.Communicate(text, voice).stream()
+    try:
+        while True:
+            try: chunk = loop.run_until_complete(chunks.__anext__())
+            except StopAsyncIteration: return
+            if chunk["type"] == "audio": yield chunk["data"]
+    finally:
+        loop.run_until_complete(chunks.aclose())
+        loop.close()
+
+VN_CHARS = "àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ"
+_VN_RE = re.compile("[" + re.escape(VN_CHARS) + "]", re.IGNORECASE)
+
 @app.post("/api/tts")
 def api_tts():
     if 'user_id' not in session: return jsonify({"error": "unauthorized"}), 401
@@ -299,31 +677,53 @@ def api_tts():
     text = data.get("text", "").strip()
     if not text: return jsonify({"error": "empty"}), 400
 
-    vn_chars = "àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ"
-    voice = "vi-VN-HoaiMyNeural" if any(c in text.lower() for c in vn_chars) else "en-US-AriaNeural"
-
-    async def get_audio():
-        communicate = edge_tts.Communicate(text, voice)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-            tmp_name = fp.name
-        await communicate.save(tmp_name)
-        return tmp_name
+    voice = "vi-VN-HoaiMyNeural" if _VN_RE.search(text) else "en-US-AriaNeural"
 
     try:
-        tmp_file = asyncio.run(get_audio())
-        with open(tmp_file, "rb") as f: audio_bytes = f.read()
-        os.unlink(tmp_file)
-        return make_response(audio_bytes, 200, {'Content-Type': 'audio/mpeg'})
+        audio = stream_tts(text, voice)
+        first = next(audio)
+    except StopIteration: return jsonify({"error": "no audio"}), 500
     except Exception as e: return jsonify({"error": str(e)}), 500
 
+    def body():
+        yield first
+        yield from audio
+    return Response(body(), mimetype="audio/mpeg")
+
+def require_admin(fn):
+    @wraps(fn)
+    def wrapper(*a, **kw):
+        if not session.get("admin"): return jsonify({"error": "401"}), 401
+        return fn(*a, **kw)
+    return wrapper
+
+def prerender(name):
+    body = app.jinja_env.get_template(name).render().encode("utf-8")
+    return body, hashlib.blake2b(body, digest_size=16).hexdigest()
+
+# the admin templates take no context, so render once; no-cache + ETag lets browsers revalidate
+# with a 304 while the login/redirect check above still runs on every request
+_ADMIN_LOGIN_PAGE = prerender("admin_login.html")
+_ADMIN_PAGE = prerender("admin.html")
+
+def static_page(page):
+    r = Response(page[0], mimetype="text/html")
+    r.set_etag(page[1])
+    r.headers["Cache-Control"] = "private, no-cache"
+    return r.make_conditional(request)
+
 @app.route("/admin")
-def admin_page(): return redirect("/admin/dashboard") if session.get("admin") else render_template("admin_login.html")
+def admin_page(): return redirect("/admin/dashboard") if session.get("admin") else static_page(_ADMIN_LOGIN_PAGE)
 @app.route("/admin/dashboard")
-def admin_dashboard(): return render_template("admin.html") if session.get("admin") else redirect("/admin")
+def admin_dashboard(): return static_page(_ADMIN_PAGE) if session.get("admin") else redirect("/admin")
 @app.post("/api/admin/login")
 def admin_login():
-    d = request.get_json()
-    if d.get("username")==ADMIN_USER and d.get("password")==ADMIN_PASSWORD:
+    d = request.get_json(silent=True)
+    d = d if isinstance(d, dict) else {}
+    u = str(d.get("username") or "").encode("utf-8")
+    p = str(d.get("password") or "").encode("utf-8")
+    # evaluate both digests unconditionally so timing doesn't reveal which field was wrong
+    if hmac.compare_digest(u, _ADMIN_USER_B) & hmac.compare_digest(p, _ADMIN_PASSWORD_B):
         session["admin"]=True
         return jsonify({"ok": True})
     return jsonify({"ok": False}), 401
@@ -332,22 +732,156 @@ def admin_logout():
     session.pop("admin", None)
     return jsonify({"ok": True})
 @app.post("/api/admin/restart")
+@require_admin
 def api_restart():
-    if not session.get("admin"): return jsonify({"error": "401"}), 401
-    os.execv(sys.executable, ['python'] + sys.argv)
+    drain_persist()
+    os.execv(_EXEC_PY, [_EXEC_PY, *_EXEC_ARGS])
+_GPU_STATIC_CACHE = None
+
+def _get_gpu_handles():
+    # handle, name and total memory never change for the life of the process
+    global _GPU_STATIC_CACHE
+    if _GPU_STATIC_CACHE is None:
+        gpus = []
+        for i in range(pynvml.nvmlDeviceGetCount()):
+            h = pynvml.nvmlDeviceGetHandleByIndex(i)
+            name = pynvml.nvmlDeviceGetName(h)
+            gpus.append((h, name.decode("utf-8") if isinstance(name, bytes) else name, pynvml.nvmlDeviceGetMemoryInfo(h).total >> 20))
+        _GPU_STATIC_CACHE = gpus
+    return _GPU_STATIC_CACHE
+
+GPU_FIELDS = ("mem", "util")
+_NVML_DISABLED_UNTIL = 0.0
+_NVML_FAILS = 0
+
+def nvidia_query(fields=GPU_FIELDS):
+    # utilization sampling is the expensive NVML call; GPU_POLL_FIELDS=mem skips it
+    global _NVML_DISABLED_UNTIL, _NVML_FAILS
+    if not NVML_AVAILABLE or time.monotonic() < _NVML_DISABLED_UNTIL: return None
+    mem, util = "mem" in fields, "util" in fields
+    try:
+        out = []
+        for h, name, total_mb in _get_gpu_handles():
+            gpu = {"name": name, "memory_total_mb": total_mb}
+            if mem: gpu["memory_used_mb"] = pynvml.nvmlDeviceGetMemoryInfo(h).used >> 20
+            if util: gpu["util_percent"] = pynvml.nvmlDeviceGetUtilizationRates(h).gpu
+            out.append(gpu)
+    except Exception:
+        # a broken driver shouldn't be re-probed on every poll: back off 10s, 20s, ... up to 10 min
+        _NVML_FAILS += 1
+        _NVML_DISABLED_UNTIL = time.monotonic() + min(600, 5 * 2 ** _NVML_FAILS)
+        return None
+    _NVML_FAILS, _NVML_DISABLED_UNTIL = 0, 0.0
+    return out
+
+def parse_gpu_fields(arg):
+    return tuple(f for f in GPU_FIELDS if f in (arg or "").split(",")) or GPU_FIELDS
+
+GPU_POLL_FIELDS = parse_gpu_fields(os.getenv("GPU_POLL_FIELDS"))
+GPU_POLL_INTERVAL_SECONDS = float(os.getenv("GPU_POLL_INTERVAL_SECONDS", "5"))
+_GPU_SNAPSHOT = None
+
+def _refresh_gpu_snapshot():
+    global _GPU_SNAPSHOT
+    _GPU_SNAPSHOT = nvidia_query(GPU_POLL_FIELDS)
+
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "2"))
+STATS_TTL = float(os.getenv("STATS_TTL", "1.5"))
+_stats = {"mem": 0.0}
+_ollama_stats = {"ok": False, "models_count": 0}
+_CPU_PCT = 0.0
+
+OLLAMA_FAIL_BACKOFF = 30
+_OLLAMA_LAST_FAIL_TS = float("-inf")
+
+def safe_ollama_get(path, timeout=2):
+    # after a failure, report "down" without touching the network until the backoff expires
+    global _OLLAMA_LAST_FAIL_TS
+    if time.monotonic() - _OLLAMA_LAST_FAIL_TS < OLLAMA_FAIL_BACKOFF: return None
+    try:
+        r = _OLLAMA_SESSION.get(OLLAMA_HOST + path, timeout=timeout)
+        r.raise_for_status()
+        data = r.json()
+    except Exception:
+        _OLLAMA_LAST_FAIL_TS = time.monotonic()
+        return None
+    _OLLAMA_LAST_FAIL_TS = float("-inf")
+    return data
+
+def _cpu_sampler():
+    # back-to-back 1 s windows: the blocking interval is the loop's clock, so no sample gaps
+    global _CPU_PCT
+    while True: _CPU_PCT = psutil.cpu_percent(interval=1.0)
+
+def _ollama_sampler():
+    # its own thread, so a slow /api/tags timeout never holds back the memory/GPU readings
+    global _ollama_stats
+    while True:
+        tags = safe_ollama_get("/api/tags")
+        _ollama_stats = {"ok": tags is not None, "models_count": len((tags or {}).get("models") or [])}
+        time.sleep(STATS_INTERVAL)
+
+def _stats_loop():
+    # NVML is only ever touched here, so its call rate is set by GPU_POLL_INTERVAL_SECONDS, not by traffic
+    global _stats
+    next_gpu = 0.0
+    while True:
+        # build a fresh dict and swap the reference so readers never see a half-updated snapshot
+        _stats = {"mem": psutil.virtual_memory().percent}
+        if NVML_AVAILABLE and time.monotonic() >= next_gpu:
+            _refresh_gpu_snapshot()
+            next_gpu = time.monotonic() + GPU_POLL_INTERVAL_SECONDS
+        time.sleep(STATS_INTERVAL)
+
+threading.Thread(target=_cpu_sampler, daemon=True).start()
+threading.Thread(target=_ollama_sampler, daemon=True).start()
+threading.Thread(target=_stats_loop, daemon=True).start()
+
+_STATS_CACHE = (float("-inf"), b"")
+_STATS_LOCK = threading.Lock()
+
+# full key set with the static values prefilled; copying it avoids growing a fresh dict key by key
+_STATS_TEMPLATE = {
+    "ts": 0, "uptime_sec": 0, "python_version": _PY_VER,
+    "memory": None, "cpu": None, "process": None, "ollama": None, "gpus": None
+}
+
+def build_stats():
+    s, o = _stats, _ollama_stats
+    info = _STATS_TEMPLATE.copy()
+    now_ns = time.time_ns()
+    info["ts"] = now_ns // 1_000_000_000
+    info["uptime_sec"] = (now_ns - _START_NS) // 1_000_000_000
+    info["memory"] = {"percent": s["mem"]}
+    info["cpu"] = {"percent": _CPU_PCT}
+    with _SELF_PROC.oneshot(): info["process"] = {"pid": _PID, "rss_bytes": _SELF_PROC.memory_info().rss}
+    info["ollama"] = {"ok": o["ok"], "host": OLLAMA_HOST, "model_name": MODEL_NAME, "models_count": o["models_count"]}
+    info["gpus"] = _GPU_SNAPSHOT
+    return info
+
 @app.get("/api/stats")
+@require_admin
 def api_stats():
-    if not session.get("admin"): return jsonify({"error": "401"}), 401
-    try: tags = requests.get(OLLAMA_HOST+"/api/tags", timeout=1).json()
-    except: tags = {}
-    return jsonify({
-        "ts": now_ts(), "uptime_sec": int(time.time()-START_TS),
-        "memory": {"percent": psutil.virtual_memory().percent},
-        "cpu": {"percent": psutil.cpu_percent()},
-        "ollama": {"ok": bool(tags)}
-    })
+    global _STATS_CACHE
+    c = _STATS_CACHE
+    if time.monotonic() - c[0] >= STATS_TTL:
+        with _STATS_LOCK:  # concurrent dashboard polls share one rebuild
+            c = _STATS_CACHE
+            if time.monotonic() - c[0] >= STATS_TTL:
+                c = _STATS_CACHE = (time.monotonic(), dumps_json(build_stats()))
+    return Response(c[1], mimetype="application/json")
 
 if __name__ == "__main__":
-    from waitress import serve
+    host, port = "0.0.0.0", 80
     print("A SEED (Trend + TTS) starting...", flush=True)
-    serve(app, host="0.0.0.0", port=80)
\ No newline at end of file
+    if os.getenv("A_SEED_SERVER", "waitress") == "uvicorn":
+        import uvicorn
+        from asgiref.wsgi import WsgiToAsgi
+        uvicorn.run(WsgiToAsgi(app), host=host, port=port, workers=1, loop="auto")
+    else:
+        from waitress import serve
+        # admin dashboards hold keep-alive connections open while polling; size and reap them explicitly
+        serve(app, host=host, port=port,
+              threads=int(os.getenv("A_SEED_THREADS", "16")),
+              connection_limit=int(os.getenv("A_SEED_CONNECTION_LIMIT", "256")),
+              channel_timeout=30, cleanup_interval=10, asyncore_use_poll=True)
\ No newline at end of file
@@ -145,24 +145,77 @@
         autoscroll();
         setTimeout(type, typingSpeed);
       } else {
-        msgElement.innerHTML = DOMPurify.sanitize(marked.parse(text));
-        
-        const emotionTag = document.createElement("div");
-        emotionTag.className = "emotion-tag fx-reveal is-visible";
-        emotionTag.textContent = emotion;
-        messageContent.appendChild(emotionTag);
-
-        logs.push({ role: 'assistant', text, emotion });
-        autoSaveDebounced();
-        autoscroll();
-        resetInputState();
-        
-        playTTS(text);
+        finishMessage(messageContent, msgElement, text, emotion);
       }
     };
     type();
   }
 
+  function finishMessage(messageContent, msgElement, text, emotion) {
+    msgElement.innerHTML = DOMPurify.sanitize(marked.parse(text));
+    
+    const emotionTag = document.createElement("div");
+    emotionTag.className = "emotion-tag fx-reveal is-visible";
+    emotionTag.textContent = emotion;
+    messageContent.appendChild(emotionTag);
+
+    logs.push({ role: 'assistant', text, emotion });
+    autoSaveDebounced();
+    autoscroll();
+    resetInputState();
+    
+    playTTS(text);
+  }
+
+  // /api/chat with stream: true sends "delta" events carrying reply text, then one "done" (or "error") event
+  async function readChatStream(res) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "", text = "", messageContent = null, msgElement = null;
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buf.indexOf("\n\n")) !== -1) {
+        const block = buf.slice(0, sep);
+        buf = buf.slice(sep + 2);
+        let event = "message", data = "";
+        for (const line of block.split("\n")) {
+          if (line.startsWith("event: ")) event = line.slice(7);
+          else if (line.startsWith("data: ")) data += line.slice(6);
+        }
+        const payload = JSON.parse(data);
+
+        if (event === "error") {
+          hideTyping();
+          typeMessage(`Error: ${payload.error}`, 'sadness');
+          return;
+        }
+        if (event === "done") {
+          const emotion = payload.emotion || "neutral";
+          sessionEmotions.push(emotion);
+          setMood(emotion);
+          if (msgElement) finishMessage(messageContent, msgElement, payload.reply || text, emotion);
+          else typeMessage(payload.reply || "...", emotion);
+          return;
+        }
+
+        if (!msgElement) {
+          hideTyping();
+          messageContent = push('assistant', '', null);
+          msgElement = messageContent.querySelector('.msg.ai');
+        }
+        text += payload.delta;
+        msgElement.innerHTML = DOMPurify.sanitize(marked.parse(text + "▌"));
+        autoscroll();
+      }
+    }
+    throw new Error("stream ended early");
+  }
+
   function showTyping() {
     if (typing) return;
     typing = document.createElement("div");
@@ -224,23 +277,12 @@
       const res = await fetch("/api/chat", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: m, history: logs.slice(-13) }),
+        body: JSON.stringify({ message: m, history: logs.slice(-13), stream: true }),
         signal: abortController.signal
       });
 
       if (!res.ok) throw new Error(`HTTP error! status: ${res.status}`);
-      const data = await res.json();
-
-      if (data.error) {
-        hideTyping();
-        typeMessage(`Error: ${data.error}`, 'sadness');
-        return;
-      }
-
-      const emotion = data.emotion || "neutral";
-      sessionEmotions.push(emotion);
-      setMood(emotion);
-      typeMessage(data.reply || "...", emotion);
+      await readChatStream(res);
 
     } catch (e) {
       if (e.name === 'AbortError') {